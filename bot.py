@@ -1,22 +1,34 @@
 import os, re, json
+import atexit, signal, sys
 import random
-import asyncio
-import hashlib, zipfile
+import asyncio, time
+import io, functools, itertools, bisect
+import hashlib, zipfile, tempfile, shutil
+import sqlite3
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Optional
+from types import MappingProxyType
+from typing import Mapping, Optional
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ext import tasks
 
+try:
+    import orjson  # optional, much faster (de)serialization of the state files
+except ImportError:
+    orjson = None
+
 # ----- Config -----
 TOKEN = os.getenv("DISCORD_TOKEN")
 IMAGES_DIR = Path(os.getenv("IMAGES_DIR", "images"))
 DAILY_DB = Path(os.getenv("DAILY_DB", "daily.json"))
-IMAGES_DB = Path(os.getenv("IMAGES_DB", "images_db.json"))
+IMAGES_DB = Path(os.getenv("IMAGES_DB", "images_db.json"))  # legacy JSON, imported into IMAGES_SQLITE once
+IMAGES_SQLITE = Path(os.getenv("IMAGES_SQLITE", str(IMAGES_DB.with_suffix(".db"))))
 USAGE_DB  = Path(os.getenv("USAGE_DB",  "usage.json"))
+SYNC_DB   = Path(os.getenv("SYNC_DB",   ".last_sync.json"))  # command fingerprints of the last sync
 
 # Export config (set these in your env/service)
 EXPORT_DIR = Path(os.getenv("EXPORT_DIR", ""))
@@ -31,7 +43,7 @@ _allowed = []
 if _single:
     _allowed.append(int(_single))
 if _multi:
-    _allowed.extend(int(x) for x in re.split(r"[,\s]+", _multi) if x)
+    _allowed.extend(int(x) for x in _multi.replace(",", " ").split())
 
 ALLOWED_GUILD_IDS: set[int] = set(_allowed)
 MY_GUILDS = [discord.Object(id=g) for g in sorted(ALLOWED_GUILD_IDS)]
@@ -43,129 +55,520 @@ CONFIG_GUILD = discord.Object(id=CONFIG_GUILD_ID) if CONFIG_GUILD_ID else None
 SYNCED = False
 MAX_DAILY_RANDOM = int(os.getenv("MAX_DAILY_RANDOM", "3"))
 RARITIES = ["Common", "Uncommon", "Rare", "Mythical", "Exquisite"]
-ALLOWED_EXT = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp4", ".webm", ".mov"}
+# Relative pull weights, e.g. RARITY_WEIGHTS="Common=1,Uncommon=0.4,Rare=0.1,Mythical=0.02"
+# Unlisted rarities weigh 1.0, so by default every image is equally likely.
+RARITY_WEIGHTS = {r: 1.0 for r in RARITIES}
+for _part in os.getenv("RARITY_WEIGHTS", "").replace(" ", "").split(","):
+    if "=" in _part:
+        _name, _w = _part.split("=", 1)
+        RARITY_WEIGHTS[_name] = float(_w)
+_UNIFORM_WEIGHTS = len(set(RARITY_WEIGHTS.values())) == 1  # plain index pick, no weight bisect
+ALLOWED_EXT = frozenset({".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp4", ".webm", ".mov"})
+_EXT_NODOT = frozenset(e[1:] for e in ALLOWED_EXT)  # matched against name[rfind(".")+1:]
+_SANITIZE = re.compile(r"[^A-Za-z0-9._-]")  # upload filename sanitizer
 
 # Reset rolls at midnight UTC by default (consistent for everyone)
+_TODAY_KEY_CACHE: tuple[int, str] = (-1, "")  # (UTC day number, "YYYY-MM-DD")
+
 def today_key() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    global _TODAY_KEY_CACHE
+    now = time.time()
+    day = int(now // 86400)
+    if day != _TODAY_KEY_CACHE[0]:
+        _TODAY_KEY_CACHE = (day, time.strftime("%Y-%m-%d", time.gmtime(now)))
+    return _TODAY_KEY_CACHE[1]
 
 # ----- Helpers -----
-def load_images() -> list[Path]:
-    if not IMAGES_DIR.exists():
-        raise RuntimeError(f"Images dir not found: {IMAGES_DIR.resolve()}")
-    imgs = sorted(p for p in IMAGES_DIR.rglob("*") if p.suffix.lower() in ALLOWED_EXT)
-    if not imgs:
-        raise RuntimeError(f"No images found in {IMAGES_DIR.resolve()}")
-    return imgs
+def _walk_images(root: Path, dirs: Optional[dict[str, int]] = None):
+    # Yield media file paths under root using a stack of scandir iterators.
+    # Dotfiles/dirs are skipped (upload probe, temp zips), as are subdirs we can't
+    # read (e.g. lost+found), like rglob did. If dirs is given, it collects each
+    # visited directory's st_mtime_ns.
+    if dirs is not None:
+        dirs[str(root)] = os.stat(root).st_mtime_ns
+    stack = [os.scandir(root)]
+    try:
+        while stack:
+            for e in stack[-1]:
+                name = e.name
+                if name.startswith("."):
+                    continue
+                if e.is_dir(follow_symlinks=False):
+                    try:
+                        mtime = e.stat(follow_symlinks=False).st_mtime_ns
+                        it = os.scandir(e.path)
+                    except (PermissionError, FileNotFoundError):
+                        continue  # unreadable or gone: skip it, and don't track its mtime
+                    if dirs is not None:
+                        dirs[e.path] = mtime
+                    stack.append(it)
+                    break
+                dot = name.rfind(".")
+                if dot > 0 and name[dot + 1:].lower() in _EXT_NODOT and e.is_file():
+                    yield e.path
+            else:
+                stack.pop().close()
+    finally:
+        for it in stack:
+            it.close()
+
+# --- In-memory state. Image metadata is written through to SQLite by set_meta;
+# daily.json and usage.json are written back by flush_daily / flush_usage when dirty
+_META_LOADED = False
+_IMAGES_CONN: Optional[sqlite3.Connection] = None
+_DAILY_CACHE: Optional[dict] = None
+_DAILY_DIRTY = False
+_STATE_LOCK = asyncio.Lock()  # serializes daily.json writeback with the shutdown flush
+_META_GEN = 0  # bumped when set_meta changes a rarity/blacklist flag; the pool compares against it
+# image metadata is held column-wise (SoA) in memory for reads; set_meta keeps
+# these in sync and writes the changed row through to SQLite
+_RARITY: dict[str, str] = {}  # key -> rarity, one entry per recorded image
+_BLACKLIST: set[str] = set()  # keys of blacklisted images
+_SHA256: dict[str, str] = {}  # key -> sha256
+_HASHES: dict[str, str] = {}  # sha256 -> key, for duplicate detection
+_USAGE_CACHE: Optional[dict] = None
+_USAGE_DIRTY = False
 
 def load_daily_db() -> dict:
-    if DAILY_DB.exists():
-        try:
-            return json.loads(DAILY_DB.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {}
+    global _DAILY_CACHE
+    if _DAILY_CACHE is None:
+        _DAILY_CACHE = _load_json(DAILY_DB, {})
+    return _DAILY_CACHE
 
 def _load_json(path: Path, default):
-    if path.exists():
-        try:
-            return json.loads(path.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return default
+    # single buffered read; a missing or corrupt file yields the default
+    try:
+        with open(path, "rb", buffering=65536) as f:
+            raw = f.read()
+        return orjson.loads(raw) if orjson else json.loads(raw)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:  # orjson.JSONDecodeError / json.JSONDecodeError are ValueErrors
+        print(f"Failed to load {path}: {e} (using defaults)")
+        return default
+
+def _dump_json(obj) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
+_UMASK = os.umask(0)  # read once at import (single-threaded); os.umask can only be read by setting it
+os.umask(_UMASK)
 
 def _save_json(path: Path, obj):
-    tmp = path.with_suffix(".tmp")
-    tmp.write_text(json.dumps(obj, indent=2), encoding="utf-8")
-    tmp.replace(path)
+    # unique tmp name (no clash between concurrent writers) + fsync before the
+    # atomic replace, so a crash can't leave a truncated file behind
+    fd, tmp = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+    try:
+        # mkstemp creates 0600 and os.replace keeps it: use the old file's mode, or what
+        # a plain open() would have given a new file
+        if hasattr(os, "fchmod"):  # POSIX (Windows only from 3.13)
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~_UMASK
+            os.fchmod(fd, mode)
+        with os.fdopen(fd, "wb", buffering=65536) as f:
+            f.write(_dump_json(obj))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:  # incl. SystemExit from the SIGTERM handler mid-write
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
 
 def save_daily_db(db: dict) -> None:
-    tmp = DAILY_DB.with_suffix(".tmp")
-    tmp.write_text(json.dumps(db, indent=2), encoding="utf-8")
-    tmp.replace(DAILY_DB)
+    global _DAILY_CACHE, _DAILY_DIRTY
+    _DAILY_CACHE = db
+    _DAILY_DIRTY = True
+
+def _flush_daily() -> None:
+    # image metadata is written through to SQLite by set_meta; only daily.json is buffered
+    global _DAILY_DIRTY
+    if _DAILY_DIRTY:
+        _save_json(DAILY_DB, _DAILY_CACHE)
+        _DAILY_DIRTY = False
+
+def _flush_usage() -> None:
+    global _USAGE_DIRTY
+    if _USAGE_DIRTY:
+        _save_json(USAGE_DB, _USAGE_CACHE)
+        _USAGE_DIRTY = False
+
+def _flush_all() -> None:
+    # final writeback on shutdown (atexit / SIGTERM)
+    try:
+        _flush_daily()
+        _flush_usage()
+    except Exception as e:
+        print(f"final flush failed: {e}")
 
 def _sha256_bytes(b: bytes) -> str:
     h = hashlib.sha256()
     h.update(b)
     return h.hexdigest()
 
+def _sha256_file(p: Path) -> str:
+    # streams the file instead of loading it whole; blocking, run via asyncio.to_thread
+    with open(p, "rb") as f:
+        if hasattr(os, "posix_fadvise"):  # let the kernel read ahead of the hash (Linux/BSD)
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # usedforsecurity=False: a dedup fingerprint, so FIPS builds may use any backend
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, lambda: hashlib.sha256(usedforsecurity=False)).hexdigest()
+        h = hashlib.sha256(usedforsecurity=False)
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+        return h.hexdigest()
+
 def pick_or_get_today(images: Optional[list[Path]] = None) -> Path:
-    images = images or list_pool_images()
-    if not images:
+    if not (images or list_pool_images()):
         raise RuntimeError("No available (non-blacklisted) images.")
     db = load_daily_db()
     key = today_key()
     p = db.get(key)
-    if p and Path(p).exists() and not get_meta(Path(p)).get("blacklisted", False):
-        return Path(p)
-    choice = random.SystemRandom().choice(images)
-    db[key] = str(choice.resolve())
+    if p and os.path.isabs(p):  # picked by an older version (absolute resolved path)
+        p = _legacy_key(p) or p
+    if p:
+        path = IMAGES_DIR / p  # keys are relative; an absolute leftover stays as-is
+        if path.exists() and _key(path) not in _blacklist():
+            return path
+    choice = images[_RNG.randrange(len(images))] if images else pick_random_image()
+    db[key] = _key(choice)  # same key as the metadata columns, so the blacklist check matches
     save_daily_db(db)
     return choice
 
+# Small hot files (e.g. today's picture) are kept in RAM, bounded by total bytes rather
+# than entry count; anything bigger (videos) is read from disk every time.
+_READ_CACHE: OrderedDict[tuple[str, int], bytes] = OrderedDict()  # (path, mtime_ns) -> data, LRU order
+_READ_CACHE_BYTES = 0
+_READ_CACHE_BUDGET = 32 * 1024 * 1024
+_READ_CACHE_MAX_FILE = 4 * 1024 * 1024
+
+def _read_file(path_str: str) -> bytes:
+    with open(path_str, "rb") as f:
+        return f.read()
+
+async def _read_bytes(path: Path) -> bytes:
+    # cache lookups stay on the event loop; only the disk read goes to a thread.
+    # mtime_ns is part of the key, so edited files are re-read.
+    global _READ_CACHE_BYTES
+    st = path.stat()
+    k = (str(path), st.st_mtime_ns)
+    data = _READ_CACHE.get(k)
+    if data is not None:
+        _READ_CACHE.move_to_end(k)
+        return data
+    data = await asyncio.to_thread(_read_file, k[0])
+    if len(data) <= _READ_CACHE_MAX_FILE and k not in _READ_CACHE:
+        _READ_CACHE[k] = data
+        _READ_CACHE_BYTES += len(data)
+        while _READ_CACHE_BYTES > _READ_CACHE_BUDGET:
+            _READ_CACHE_BYTES -= len(_READ_CACHE.popitem(last=False)[1])
+    return data
+
 async def send_image(interaction: discord.Interaction, path: Path, title: str):
     try:
         await interaction.response.defer(thinking=False)
     except discord.InteractionResponded:
         pass
-    file = discord.File(str(path), filename=path.name)
+    # hot images (e.g. today's picture) are served from RAM; misses are read off the event loop
+    data = await _read_bytes(path)
+    file = discord.File(io.BytesIO(data), filename=path.name)
     await interaction.followup.send(content=title, file=file)
 
 # --- Image metadata
-def _images_db():
-    db = _load_json(IMAGES_DB, {"images": {}, "hashes": {}})  # <-- ensure hashes index exists
+_IMAGES_ROOT = IMAGES_DIR.resolve()
+
+@functools.lru_cache(maxsize=1024)
+def _resolve(path_str: str) -> Path:
+    # realpath walks every component with lstat; media paths don't move under us
+    return Path(path_str).resolve()
+
+def _key(p: Path) -> str:
+    # DB key: POSIX path relative to IMAGES_DIR (portable, no realpath syscalls)
+    try:
+        return p.relative_to(IMAGES_DIR).as_posix()
+    except ValueError:
+        pass
+    r = _resolve(str(p))  # e.g. absolute paths stored in daily.json
+    try:
+        return r.relative_to(_IMAGES_ROOT).as_posix()
+    except ValueError:
+        return str(r)
+
+def _legacy_key(k: str) -> Optional[str]:
+    # Map an old absolute str(p.resolve()) key to the current relative key. Symlinked
+    # media resolved to its target, possibly outside IMAGES_DIR, so those are looked
+    # up among the walked files by what they resolve to (first link wins).
+    root = str(_IMAGES_ROOT) + os.sep
+    if k.startswith(root):
+        return Path(k[len(root):]).as_posix()
+    if getattr(_legacy_key, "gen", None) != _IMG_LIST_GEN:
+        targets: dict[str, str] = {}
+        for p in list_all_images():
+            targets.setdefault(str(_resolve(str(p))), _key(p))
+        _legacy_key.targets, _legacy_key.gen = targets, _IMG_LIST_GEN
+    return _legacy_key.targets.get(k)
+
+def _migrate_keys(db: dict) -> None:
+    # older DBs were keyed by absolute resolved paths; rewrite the ones we can place.
+    # db["hashes"] isn't migrated: _HASHES is rebuilt from the sha256 column.
+    for old in [k for k in db["images"] if os.path.isabs(k)]:
+        new = _legacy_key(old)
+        if new:
+            db["images"].setdefault(new, db["images"].pop(old))
+
+def _import_json_db(conn: sqlite3.Connection) -> None:
+    # one-shot migration from images_db.json; the JSON file is left in place as a backup
+    db = _load_json(IMAGES_DB, None)
+    if not db:
+        return
     if "images" not in db: db["images"] = {}
-    if "hashes" not in db: db["hashes"] = {}
-    return db
-
-def get_meta(p: Path) -> dict:
-    db = _images_db()
-    key = str(p.resolve())
-    rec = db["images"].get(key)
-    if rec is None:
-        rec = {"rarity": "Common", "blacklisted": False}
-        db["images"][key] = rec
-        _save_json(IMAGES_DB, db)
+    _migrate_keys(db)
+    rows = [
+        (k, rec.get("rarity", "Common"), int(bool(rec.get("blacklisted"))), rec.get("sha256"))
+        for k, rec in db["images"].items()
+    ]
+    conn.execute("BEGIN")
+    try:
+        conn.executemany("INSERT OR REPLACE INTO images (path, rarity, blacklisted, sha256) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"Migrated {len(rows)} image record(s) from {IMAGES_DB} to {IMAGES_SQLITE}")
+
+def _images_conn() -> sqlite3.Connection:
+    global _IMAGES_CONN
+    if _IMAGES_CONN is None:
+        conn = sqlite3.connect(IMAGES_SQLITE, isolation_level=None)  # autocommit; BEGIN explicitly for batches
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "path TEXT PRIMARY KEY, rarity TEXT NOT NULL DEFAULT 'Common', "
+            "blacklisted INTEGER NOT NULL DEFAULT 0, sha256 TEXT)"
+        )
+        # not UNIQUE: duplicate files legitimately share a hash (cfg_rehash counts them)
+        conn.execute("CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256)")
+        if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+            _import_json_db(conn)
+            conn.execute("PRAGMA user_version = 1")
+        _IMAGES_CONN = conn
+    return _IMAGES_CONN
+
+def _ensure_meta_loaded() -> None:
+    # rows are read once into the in-memory columns; set_meta writes through
+    global _META_LOADED
+    if _META_LOADED:
+        return
+    rows = _images_conn().execute("SELECT path, rarity, blacklisted, sha256 FROM images ORDER BY rowid")
+    for k, rarity, black, sha in rows:
+        _RARITY[k] = rarity
+        if black:
+            _BLACKLIST.add(k)
+        if sha:
+            _SHA256[k] = sha
+            _HASHES[sha] = k
+    _META_LOADED = True
+
+_UPSERT_META = (
+    "INSERT INTO images (path, rarity, blacklisted, sha256) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(path) DO UPDATE SET rarity = excluded.rarity, "
+    "blacklisted = excluded.blacklisted, sha256 = excluded.sha256"
+)
+
+def _meta_row(key: str) -> tuple:
+    return (key, _RARITY[key], int(key in _BLACKLIST), _SHA256.get(key))
+
+def _save_meta_row(key: str) -> None:
+    _images_conn().execute(_UPSERT_META, _meta_row(key))
+
+def _save_meta_rows(keys: list[str]) -> None:
+    # one transaction (one WAL commit) for a batch of set_meta(..., persist=False) calls
+    conn = _images_conn()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(_UPSERT_META, [_meta_row(k) for k in keys])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _record(k: str) -> dict:
+    rec = {"rarity": _RARITY[k], "blacklisted": k in _BLACKLIST}
+    if k in _SHA256:
+        rec["sha256"] = _SHA256[k]
     return rec
 
-def set_meta(p: Path, *, rarity: Optional[str] = None, blacklisted: Optional[bool] = None, sha256: Optional[str] = None) -> dict:
-    db = _images_db()
-    key = str(p.resolve())
-    rec = db["images"].get(key) or {"rarity": "Common", "blacklisted": False}
-    if rarity is not None:
-        if rarity not in RARITIES:
-            raise ValueError(f"Invalid rarity: {rarity}")
-        rec["rarity"] = rarity
+def _blacklist() -> set[str]:
+    _ensure_meta_loaded()  # populates _BLACKLIST on first load
+    return _BLACKLIST
+
+# shared default for images without a record; read-only so callers can't mutate it
+_DEFAULT_META = MappingProxyType({"rarity": "Common", "blacklisted": False})
+
+def get_meta(p: Path) -> Mapping:
+    # read-only: records are only created by set_meta
+    _ensure_meta_loaded()
+    k = _key(p)
+    return _record(k) if k in _RARITY else _DEFAULT_META
+
+def set_meta(p: Path, *, rarity: Optional[str] = None, blacklisted: Optional[bool] = None, sha256: Optional[str] = None, persist: bool = True) -> dict:
+    # persist=False only updates memory; the caller must _save_meta_rows() the keys afterwards
+    global _META_GEN
+    _ensure_meta_loaded()
+    key = _key(p)
+    if rarity is not None and rarity not in RARITIES:
+        raise ValueError(f"Invalid rarity: {rarity}")
+    old_rarity, was_black = _RARITY.get(key, _DEFAULT_META["rarity"]), key in _BLACKLIST
+    _RARITY[key] = rarity or old_rarity
     if blacklisted is not None:
-        rec["blacklisted"] = bool(blacklisted)
+        if blacklisted:
+            _BLACKLIST.add(key)
+        else:
+            _BLACKLIST.discard(key)
     if sha256 is not None:
-        rec["sha256"] = sha256
-        db["hashes"][sha256] = key  # index for duplicate detection
-    db["images"][key] = rec
-    _save_json(IMAGES_DB, db)
-    return rec
+        _SHA256[key] = sha256
+        _HASHES[sha256] = key  # index for duplicate detection
+    if persist:
+        _save_meta_row(key)
+    # only rarity/blacklist changes affect the index and the pull pool
+    if _RARITY[key] != old_rarity or (key in _BLACKLIST) != was_black:
+        _index_update(key)
+        _META_GEN += 1
+    return _record(key)
+
+# --- Image list cache (rescanned only when a directory mtime changes)
+_IMG_LIST_CACHE: Optional[list[Path]] = None
+_IMG_LIST_MTIME: dict[str, int] = {}  # dir path -> st_mtime_ns at scan time
+_IMG_LIST_GEN = 0  # bumped on every rescan; derived caches compare against it
+
+def _scan_images() -> tuple[list[Path], dict[str, int]]:
+    dirs: dict[str, int] = {}
+    imgs = sorted(Path(p) for p in _walk_images(IMAGES_DIR, dirs))
+    return imgs, dirs
+
+def _img_list_stale() -> bool:
+    if _IMG_LIST_CACHE is None:
+        return True
+    for d, m in _IMG_LIST_MTIME.items():
+        try:
+            if os.stat(d).st_mtime_ns != m:
+                return True
+        except OSError:
+            return True
+    return False
+
+def _invalidate_images() -> None:
+    global _IMG_LIST_CACHE
+    _IMG_LIST_CACHE = None
+
+def _add_image(p: Path, before: int, after: int) -> None:
+    # Register a file we just wrote without rescanning the whole tree. before/after are
+    # the dir's mtime_ns right before and after our write: if the recorded mtime is
+    # neither, something else changed the dir too, so rescan instead.
+    global _IMG_LIST_CACHE, _IMG_LIST_GEN
+    d = str(p.parent)
+    imgs = _IMG_LIST_CACHE
+    if imgs is None or _IMG_LIST_MTIME.get(d) not in (before, after):
+        _invalidate_images()
+        return
+    i = bisect.bisect_left(imgs, p)
+    if i < len(imgs) and imgs[i] == p:
+        return  # a rescan during the write already picked it up
+    # copy-on-write: cfg_export may be zipping the current list in a worker thread
+    _IMG_LIST_CACHE = imgs[:i] + [p] + imgs[i:]
+    _IMG_LIST_MTIME[d] = after
+    _IMG_LIST_GEN += 1
 
 def list_all_images() -> list[Path]:
-    return sorted(p for p in IMAGES_DIR.rglob("*") if p.suffix.lower() in ALLOWED_EXT)
+    global _IMG_LIST_CACHE, _IMG_LIST_MTIME, _IMG_LIST_GEN
+    if not IMAGES_DIR.is_dir():
+        if _IMG_LIST_CACHE:
+            _IMG_LIST_CACHE = None
+            _IMG_LIST_GEN += 1
+        return []
+    if _img_list_stale():
+        _IMG_LIST_CACHE, _IMG_LIST_MTIME = _scan_images()
+        _IMG_LIST_GEN += 1
+    return _IMG_LIST_CACHE
+
+# --- Image index: SoA view of the image metadata, positionally aligned with list_all_images()
+_IDX_GEN = -1  # _IMG_LIST_GEN the index was built for
+_IDX_POS: dict[str, int] = {}  # key -> position
+_IDX_RARITY: list[str] = []
+_IDX_BLACK = bytearray()
+
+def _indexed_images() -> list[Path]:
+    # the image list, with the parallel arrays above rebuilt if it was rescanned
+    global _IDX_GEN, _IDX_POS, _IDX_RARITY, _IDX_BLACK
+    imgs = list_all_images()
+    if _IDX_GEN != _IMG_LIST_GEN:
+        _ensure_meta_loaded()
+        keys = [_key(p) for p in imgs]  # computed once per rescan
+        _IDX_POS = {k: i for i, k in enumerate(keys)}
+        _IDX_RARITY = [_RARITY.get(k, "Common") for k in keys]
+        _IDX_BLACK = bytearray(k in _BLACKLIST for k in keys)
+        _IDX_GEN = _IMG_LIST_GEN
+    return imgs
+
+def _index_update(key: str) -> None:
+    # called by set_meta so the arrays stay in sync without a rebuild
+    i = _IDX_POS.get(key)
+    if i is not None and _IDX_GEN == _IMG_LIST_GEN:
+        _IDX_RARITY[i] = _RARITY[key]
+        _IDX_BLACK[i] = key in _BLACKLIST
+
+# --- Pull pool: non-blacklisted images + cumulative rarity weights
+_RNG = random.Random()  # seeded from os.urandom once
+_POOL_PATHS: list[Path] = []
+_POOL_CUM: list[float] = []
+_POOL_KEY = None  # (_IMG_LIST_GEN, _META_GEN) the pool was built for
+
+def _pool() -> tuple[list[Path], list[float]]:
+    global _POOL_PATHS, _POOL_CUM, _POOL_KEY
+    imgs = _indexed_images()
+    key = (_IMG_LIST_GEN, _META_GEN)
+    if key != _POOL_KEY:
+        paths, cum, total = [], [], 0.0
+        for p, r, black in zip(imgs, _IDX_RARITY, _IDX_BLACK):  # the cached list only holds files that exist
+            if black: continue
+            total += max(0.0, RARITY_WEIGHTS.get(r, 1.0))
+            paths.append(p)
+            cum.append(total)
+        _POOL_PATHS, _POOL_CUM, _POOL_KEY = paths, cum, key
+    return _POOL_PATHS, _POOL_CUM
 
 def list_pool_images() -> list[Path]:
-    # not blacklisted and exists
-    imgs = []
-    for p in list_all_images():
-        if not p.exists(): continue
-        if get_meta(p).get("blacklisted"): continue
-        imgs.append(p)
-    return imgs
+    # not blacklisted
+    return _pool()[0]
+
+def pick_random_image() -> Optional[Path]:
+    paths, cum = _pool()
+    if not paths:
+        return None
+    if _UNIFORM_WEIGHTS or cum[-1] <= 0:  # equal weights (or all 0): uniform pick
+        return paths[_RNG.randrange(len(paths))]
+    return _RNG.choices(paths, cum_weights=cum, k=1)[0]
 
 # --- User use restrictions
 def _usage_db():
-    return _load_json(USAGE_DB, {})  # { "YYYY-MM-DD": { "user_id": int } }
+    global _USAGE_CACHE
+    if _USAGE_CACHE is None:
+        _USAGE_CACHE = _load_json(USAGE_DB, {})  # { "YYYY-MM-DD": { "user_id": int } }
+    return _USAGE_CACHE
 
 def get_user_uses(user_id: int) -> int:
     db = _usage_db()
     return int(db.get(today_key(), {}).get(str(user_id), 0))
 
 def inc_user_uses(user_id: int) -> int:
+    global _USAGE_DIRTY
     db = _usage_db()
     day = today_key()
     daymap = db.setdefault(day, {})
@@ -175,17 +578,42 @@ def inc_user_uses(user_id: int) -> int:
     if len(db) > 7:
         for k in sorted(db.keys())[:-7]:
             db.pop(k, None)
-    _save_json(USAGE_DB, db)
+    _USAGE_DIRTY = True
     return new_count
 
+# --- Images dir write probe (once at startup instead of per upload)
+_IMAGES_DIR_WRITABLE = False
+
+def _probe_images_dir() -> bool:
+    try:
+        IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+        probe = IMAGES_DIR / "._writetest"
+        probe.write_text("ok", encoding="utf-8")
+        probe.unlink(missing_ok=True)
+        return True
+    except OSError as e:
+        print(f"Images dir not writable: {IMAGES_DIR} ({e})")
+        return False
+
+# --- State bootstrap
+def _bootstrap_state() -> None:
+    # Load daily.json, the image metadata and usage.json together up front so no
+    # command pays for a first lazy load; the loaders are no-ops once loaded.
+    load_daily_db()
+    _ensure_meta_loaded()
+    _usage_db()
+
 # --- Presence rotation -------------------------------------------------
-def _presence_variants():
-    # try to get image count; fall back to "?" if images missing
+def _image_count():
+    # image count from the cached list; fall back to "?" if images missing
     try:
-        img_count = len(load_images())
+        return len(list_all_images()) or "?"
     except Exception:
-        img_count = "?"
+        return "?"
 
+def _presence_variants(img_count=None):
+    if img_count is None:
+        img_count = _image_count()
     return [
         discord.Activity(type=discord.ActivityType.watching,   name=f"{img_count} pictures"),
         discord.Activity(type=discord.ActivityType.listening,  name="/daily and /random"),
@@ -194,18 +622,75 @@ def _presence_variants():
     
 @tasks.loop(minutes=2)
 async def rotate_presence():
-    variants = _presence_variants()
-    idx = getattr(rotate_presence, "idx", 0)
-    await bot.change_presence(status=discord.Status.online, activity=variants[idx % len(variants)])
-    rotate_presence.idx = idx + 1
+    # the variants only embed the image count, so rebuild them only when it changes
+    count = _image_count()
+    if getattr(rotate_presence, "count", None) != count:
+        rotate_presence.variants = _presence_variants(count)
+        rotate_presence.count = count
+    variants = rotate_presence.variants
+    if not hasattr(rotate_presence, "cycle"):
+        rotate_presence.cycle = itertools.cycle(range(len(variants)))
+    await bot.change_presence(status=discord.Status.online, activity=variants[next(rotate_presence.cycle)])
 # -----------------------------------------------------------------------
 
 # ----- Bot setup -----
+class ImageBot(commands.Bot):
+    async def close(self):
+        # persist buffered daily/usage state before the connection goes away
+        async with _STATE_LOCK:
+            _flush_all()
+        await super().close()
+
 intents = discord.Intents.default()  # slash cmds don't need message-content intent
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = ImageBot(command_prefix="!", intents=intents)
+
+def _command_dict(c) -> dict:
+    try:
+        return c.to_dict(bot.tree)
+    except TypeError:  # discord.py < 2.4: to_dict() takes no tree
+        return c.to_dict()
+
+def _commands_sig(gobj: Optional[discord.Object]) -> str:
+    payload = [_command_dict(c) for c in bot.tree.get_commands(guild=gobj)]
+    raw = json.dumps([bot.application_id, payload], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def _sync_commands(targets: list[Optional[discord.Object]], force: bool = False):
+    # Sync the targets (None = global commands) concurrently, skipping any whose
+    # command payload matches the fingerprint recorded at its last successful sync
+    # (unless force: the guild's commands may be gone even though ours didn't change).
+    last = _load_json(SYNC_DB, {})
+    sigs, todo = {}, []
+    for gobj in targets:
+        # IMPORTANT: never clear guild commands. For the config guild this copies
+        # globals next to the dev cmds; for other guilds it just copies globals.
+        if gobj is not None:
+            bot.tree.copy_global_to(guild=gobj)
+        k = str(gobj.id) if gobj else "global"
+        sigs[k] = _commands_sig(gobj)
+        if not force and last.get(k) == sigs[k]:
+            print(f"Commands unchanged for {k}, skipping sync")
+        else:
+            todo.append((k, gobj))
+    results = await asyncio.gather(*(bot.tree.sync(guild=g) for _, g in todo), return_exceptions=True)
+    for (k, gobj), cmds in zip(todo, results):
+        if isinstance(cmds, Exception):
+            print(f"Sync failed for {k}: {cmds}")
+            continue
+        last[k] = sigs[k]
+        where = f"guild {k}" if gobj else "global"
+        print(f"Synced {len(cmds)} cmds to {where}: {[c.name for c in cmds]}")
+    if todo:
+        _save_json(SYNC_DB, last)
 
 @bot.event
 async def on_ready():
+    # Load all state files before anything else touches them
+    _bootstrap_state()
+
+    global _IMAGES_DIR_WRITABLE
+    _IMAGES_DIR_WRITABLE = _probe_images_dir()
+
     # Leave any non-whitelisted guilds
     if ALLOWED_GUILD_IDS:
         for g in list(bot.guilds):
@@ -222,25 +707,20 @@ async def on_ready():
     if not purge_exports.is_running():
         purge_exports.start()
 
+    # Start state writeback tasks
+    if not flush_daily.is_running():
+        flush_daily.start()
+    if not flush_usage.is_running():
+        flush_usage.start()
+
     # Sync commands
     global SYNCED
     if not SYNCED:
         if MY_GUILDS:
-            for gobj in MY_GUILDS:
-                # IMPORTANT:
-                # - For config guild: DO NOT clear. Copy globals + sync (keeps dev cmds).
-                # - For other guilds: copy globals + sync (as before).
-                if CONFIG_GUILD and gobj.id == CONFIG_GUILD.id:
-                    bot.tree.copy_global_to(guild=gobj)
-                    cmds = await bot.tree.sync(guild=gobj)
-                else:
-                    bot.tree.copy_global_to(guild=gobj)
-                    cmds = await bot.tree.sync(guild=gobj)
-                print(f"Synced {len(cmds)} cmds to guild {gobj.id}: {[c.name for c in cmds]}")
+            await _sync_commands(MY_GUILDS)
             print(f"Synced to {len(MY_GUILDS)} guild(s).")
         else:
-            cmds = await bot.tree.sync()
-            print(f"Synced {len(cmds)} global cmds: {[c.name for c in cmds]}")
+            await _sync_commands([None])
         SYNCED = True
 
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
@@ -251,16 +731,9 @@ async def on_guild_join(guild: discord.Guild):
         print(f"Leaving unauthorized guild on join: {guild.name} ({guild.id})")
         await guild.leave()
         return
-    # If it is allowed, make sure commands are synced there too
-    gobj = discord.Object(id=guild.id)
-    # For config guild: DO NOT clear. Copy globals + sync so it has both standard and dev cmds.
-    if CONFIG_GUILD and guild.id == CONFIG_GUILD.id:
-        bot.tree.copy_global_to(guild=gobj)  # <-- added
-        cmds = await bot.tree.sync(guild=gobj)
-    else:
-        bot.tree.copy_global_to(guild=gobj)
-        cmds = await bot.tree.sync(guild=gobj)
-    print(f"Synced {len(cmds)} cmds to newly allowed guild {guild.id}")
+    # If it is allowed, make sure commands are synced there too (always: a re-add
+    # or an out-of-band wipe leaves the stored fingerprint matching)
+    await _sync_commands([discord.Object(id=guild.id)], force=True)
 
 @tasks.loop(hours=1)
 async def purge_exports():
@@ -279,11 +752,26 @@ async def purge_exports():
     except Exception as e:
         print(f"purge_exports error: {e}")
 
+@tasks.loop(seconds=5)
+async def flush_daily():
+    try:
+        async with _STATE_LOCK:
+            _flush_daily()
+    except Exception as e:
+        print(f"flush_daily error: {e}")
+
+@tasks.loop(seconds=10)
+async def flush_usage():
+    try:
+        _flush_usage()
+    except Exception as e:
+        print(f"flush_usage error: {e}")
+
 # --- Public commands @app_commands.guilds(*MY_GUILDS)
 @bot.tree.command(name="daily", description="Send today's picture (same for everyone).")
 async def daily_cmd(interaction: discord.Interaction):
     try:
-        path = pick_or_get_today(list_pool_images())
+        path = pick_or_get_today()
         r = get_meta(path)["rarity"]
         await send_image(interaction, path, f"📅 Today's picture ({today_key()} UTC)\n✨ Rarity: **{r}**")
     except Exception as e:
@@ -300,12 +788,11 @@ async def random_cmd(interaction: discord.Interaction):
             )
             return
 
-        images = list_pool_images()
-        if not images:
+        path = pick_random_image()
+        if path is None:
             await interaction.response.send_message("No available images.", ephemeral=True)
             return
 
-        path = random.SystemRandom().choice(images)
         meta = get_meta(path)
         count = inc_user_uses(interaction.user.id)
         left = max(0, MAX_DAILY_RANDOM - count)
@@ -333,10 +820,14 @@ async def cfg_next(interaction: discord.Interaction):
     if not imgs:
         await interaction.response.send_message("No images.", ephemeral=True)
         return
-    # simple per-admin round-robin
-    idx = getattr(cfg_next, "idx", 0)
-    p = imgs[idx % len(imgs)]
-    cfg_next.idx = idx + 1
+    # simple round-robin; after a rescan, resume after the last image shown
+    if getattr(cfg_next, "gen", None) != _IMG_LIST_GEN:
+        last = getattr(cfg_next, "last", None)
+        start = bisect.bisect_right(imgs, last) if last else 0
+        cfg_next.cycle = itertools.cycle(imgs[start:] + imgs[:start])
+        cfg_next.gen = _IMG_LIST_GEN
+    p = next(cfg_next.cycle)
+    cfg_next.last = p
     ADMIN_CURRENT[interaction.user.id] = p
     m = get_meta(p)
     await send_image(
@@ -345,15 +836,67 @@ async def cfg_next(interaction: discord.Interaction):
         f"Config: **{p.name}**\nrarity: **{m['rarity']}** • blacklisted: **{m['blacklisted']}**"
     )
     
-def _all_names():
-    return [p.name for p in list_all_images()]
+_NAMES_LC_CACHE: list[tuple[str, str]] = []  # (casefolded, original) filenames
+_PREFIX_SORTED: list[tuple[str, str]] = []  # same pairs, sorted for bisect prefix lookups
+_NAMES_BLOB = ""  # casefolded names joined by "\0", so substring search is one str.find() scan
+_NAMES_OFF: list[int] = []  # start offset of each name in _NAMES_BLOB, plus an end sentinel
+_NAMES_LC_GEN = -1
+
+def _names_lc() -> list[tuple[str, str]]:
+    global _NAMES_LC_CACHE, _PREFIX_SORTED, _NAMES_BLOB, _NAMES_OFF, _NAMES_LC_GEN
+    imgs = list_all_images()
+    if _NAMES_LC_GEN != _IMG_LIST_GEN:
+        _NAMES_LC_CACHE = [(p.name.casefold(), p.name) for p in imgs]
+        _PREFIX_SORTED = sorted(_NAMES_LC_CACHE)
+        _NAMES_BLOB = "\0".join(lc for lc, _ in _NAMES_LC_CACHE) + "\0"
+        _NAMES_OFF = [0]
+        for lc, _ in _NAMES_LC_CACHE:
+            _NAMES_OFF.append(_NAMES_OFF[-1] + len(lc) + 1)
+        _NAMES_LC_GEN = _IMG_LIST_GEN
+    return _NAMES_LC_CACHE
+
+_NAME_TO_PATH: dict[str, Path] = {}  # lowercased filename -> first image with it (sorted order)
+_NAME_TO_PATH_GEN = -1
+
+def _name_index() -> dict[str, Path]:
+    global _NAME_TO_PATH, _NAME_TO_PATH_GEN
+    imgs = list_all_images()
+    if _NAME_TO_PATH_GEN != _IMG_LIST_GEN:
+        idx: dict[str, Path] = {}
+        for p in imgs:
+            idx.setdefault(p.name.lower(), p)
+        _NAME_TO_PATH, _NAME_TO_PATH_GEN = idx, _IMG_LIST_GEN
+    return _NAME_TO_PATH
+
+@functools.lru_cache(maxsize=256)
+def _ac_match(q: str, gen: int) -> tuple[str, ...]:
+    # gen keys results to one image list; typing/backspacing repeats queries a lot.
+    # The caller has just run _names_lc() for gen, so the globals are current: no re-stat here.
+    names = _NAMES_LC_CACHE
+    if not q:
+        return tuple(orig for _, orig in names[:25])  # Discord's choice limit
+    # prefix hits first, straight from the sorted index...
+    out = []
+    i = bisect.bisect_left(_PREFIX_SORTED, (q,))
+    while i < len(_PREFIX_SORTED) and len(out) < 25 and _PREFIX_SORTED[i][0].startswith(q):
+        out.append(_PREFIX_SORTED[i][1])
+        i += 1
+    # ...then substring matches, only scanned when the prefix hits don't fill the list
+    # (one find() over the whole blob per hit; positions map back to names via the offsets)
+    if len(out) < 25 and "\0" not in q:
+        pos = _NAMES_BLOB.find(q)
+        while pos != -1 and len(out) < 25:
+            j = bisect.bisect_right(_NAMES_OFF, pos) - 1
+            if not _NAMES_BLOB.startswith(q, _NAMES_OFF[j]):  # prefix hits are already in
+                out.append(names[j][1])
+            pos = _NAMES_BLOB.find(q, _NAMES_OFF[j + 1])  # at most one hit per name
+    return tuple(out)
 
 async def _ac_names(interaction: discord.Interaction, current: str):
-    names = _all_names()
-    q = current.lower().strip()
-    if q:
-        names = [n for n in names if q in n.lower()]
-    return [app_commands.Choice(name=n, value=n) for n in names[:25]]
+    # runs on every keystroke: match against the prebuilt index
+    _names_lc()  # revalidates the image list, so _IMG_LIST_GEN is current
+    names = _ac_match(current.casefold().strip(), _IMG_LIST_GEN)
+    return [app_commands.Choice(name=n, value=n) for n in names]
     
 @bot.tree.command(name="cfg_select", description="Select an image by filename to configure.", guild=CONFIG_GUILD)
 @app_commands.autocomplete(name=_ac_names)
@@ -362,9 +905,8 @@ async def cfg_select(interaction: discord.Interaction, name: str):
         await interaction.response.send_message("Not allowed.", ephemeral=True); return
 
     # pick the first exact (case-insensitive), else first contains
-    imgs = list_all_images()
-    exact = [p for p in imgs if p.name.lower() == name.lower()]
-    cand = exact[0] if exact else next((p for p in imgs if name.lower() in p.name.lower()), None)
+    idx, q = _name_index(), name.lower()
+    cand = idx.get(q) or next((p for low, p in idx.items() if q in low), None)
 
     if not cand:
         await interaction.response.send_message("No match.", ephemeral=True); return
@@ -407,6 +949,51 @@ async def cfg_toggle_blacklist(interaction: discord.Interaction):
         ephemeral=True
     )
 
+def _place_file(tmp: Path, dest: Path) -> None:
+    # Move tmp to dest without clobbering; raises FileExistsError if dest is taken.
+    if not getattr(_place_file, "no_link", False):
+        try:
+            os.link(tmp, dest)
+            return
+        except FileExistsError:
+            raise
+        except OSError as e:
+            # no hard links here (vfat/exFAT, some SMB/FUSE mounts); remember that
+            print(f"os.link unsupported in {IMAGES_DIR} ({e}), falling back to rename")
+            _place_file.no_link = True
+    # reserve the name with O_EXCL, then rename the finished file over the placeholder
+    os.close(os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+    try:
+        os.replace(tmp, dest)
+    except Exception:
+        dest.unlink(missing_ok=True)
+        raise
+
+def _write_new_file(data: bytes, stem: str, ext: str) -> tuple[Path, int, int]:
+    # Blocking; run via asyncio.to_thread. Writes to a hidden .part file (skipped by the
+    # image walker), then places it under the first free name: neither path clobbers,
+    # so concurrent uploads can't take the same name, and the file only appears complete.
+    # Returns (dest, dir mtime_ns before we touched it, dir mtime_ns after) for _add_image.
+    before = os.stat(IMAGES_DIR).st_mtime_ns
+    tmp = IMAGES_DIR / f".{os.urandom(8).hex()}.part"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        dest, i = IMAGES_DIR / f"{stem}{ext}", 1
+        while True:
+            try:
+                _place_file(tmp, dest)
+                break
+            except FileExistsError:
+                dest = IMAGES_DIR / f"{stem}_{i}{ext}"
+                i += 1
+    finally:
+        tmp.unlink(missing_ok=True)
+    return dest, before, os.stat(IMAGES_DIR).st_mtime_ns  # after the .part is gone too
+
+_UPLOADS_PENDING: set[str] = set()  # sha256 of uploads still being written (not in _HASHES yet)
+
 @bot.tree.command(name="cfg_upload", description="Upload a media file into the bot's folder.", guild=CONFIG_GUILD)
 @app_commands.describe(file="Attach an image/video", rarity="Optional rarity")
 @app_commands.choices(rarity=[app_commands.Choice(name=r, value=r) for r in RARITIES])
@@ -427,32 +1014,42 @@ async def cfg_upload(interaction: discord.Interaction, file: discord.Attachment,
         sha = _sha256_bytes(raw)
 
         # Duplicate check via hash index
-        db = _images_db()
-        dup_path = db.get("hashes", {}).get(sha)
-        if dup_path and Path(dup_path).exists():
+        _ensure_meta_loaded()
+        dup_path = _HASHES.get(sha)
+        if dup_path and (IMAGES_DIR / dup_path).exists():
             await interaction.followup.send(f"❌ Duplicate file detected. Already uploaded as **{Path(dup_path).name}**.", ephemeral=True)
             return
+        if sha in _UPLOADS_PENDING:
+            await interaction.followup.send("❌ Duplicate file detected. The same file is being uploaded right now.", ephemeral=True)
+            return
 
-        # Ensure we can write to the images dir
-        IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-        probe = IMAGES_DIR / "._writetest"
-        probe.write_text("ok", encoding="utf-8")
-        probe.unlink(missing_ok=True)
-
-        # Sanitize and ensure unique filename
-        safe = re.sub(r"[^A-Za-z0-9._-]", "_", file.filename)
-        dest = IMAGES_DIR / safe
-        i = 1
-        while dest.exists():
-            stem, ext = os.path.splitext(safe)
-            dest = IMAGES_DIR / f"{stem}_{i}{ext}"
-            i += 1
-
-        print(f"/cfg_upload saving to {dest} ({file.size} bytes)")
-        dest.write_bytes(raw)
+        # Ensure we can write to the images dir (success is cached; a failed probe is retried)
+        global _IMAGES_DIR_WRITABLE
+        if not _IMAGES_DIR_WRITABLE:
+            _IMAGES_DIR_WRITABLE = _probe_images_dir()
+        if not _IMAGES_DIR_WRITABLE:
+            await interaction.followup.send("❌ Upload failed: images dir is not writable.", ephemeral=True); return
+
+        list_all_images()  # make sure the image list cache is current before we add to it
+
+        # Sanitize, then write off the event loop under the first free name
+        safe = _SANITIZE.sub("_", file.filename)
+        dot = safe.rfind(".")  # the extension check above guarantees one
+        # no leading dots: the image walker skips dotfiles, so the upload would vanish
+        stem, ext = safe[:dot].lstrip(".") or "upload", safe[dot:]
+        # the hash is reserved from the duplicate check until set_meta records it,
+        # since the write below yields to the event loop
+        _UPLOADS_PENDING.add(sha)
+        try:
+            print(f"/cfg_upload saving {safe} ({file.size} bytes)")
+            dest, before, after = await asyncio.to_thread(_write_new_file, raw, stem, ext)
+            print(f"/cfg_upload saved to {dest}")
+            _add_image(dest, before, after)
 
-        # Register + rarity + sha256
-        meta = set_meta(dest, rarity=(rarity.value if rarity else None), sha256=sha)
+            # Register + rarity + sha256
+            meta = set_meta(dest, rarity=(rarity.value if rarity else None), sha256=sha)
+        finally:
+            _UPLOADS_PENDING.discard(sha)
 
         await interaction.followup.send(
             f"✅ Uploaded: **{dest.name}**\nrarity: **{meta['rarity']}** • blacklisted: **{meta['blacklisted']}**",
@@ -468,6 +1065,15 @@ async def cfg_upload(interaction: discord.Interaction, file: discord.Attachment,
         except Exception:
             pass
 
+def _build_zip(zip_path: Path, items: list[Path], root: Path) -> None:
+    # media is already compressed, so store it; deflating would only burn CPU
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for p in items:
+            # store relative to root; copy in 1 MiB blocks instead of zipfile's 8 KiB
+            info = zipfile.ZipInfo.from_file(p, p.relative_to(root))
+            with open(p, "rb") as src, zf.open(info, "w", force_zip64=True) as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+
 @bot.tree.command(name="cfg_export", description="Create a ZIP of all media and publish a link.", guild=CONFIG_GUILD)
 async def cfg_export(interaction: discord.Interaction):
     if not _is_admin(interaction):
@@ -490,12 +1096,8 @@ async def cfg_export(interaction: discord.Interaction):
         tmp_zip = (IMAGES_DIR / f".{zip_name}")  # temp in images dir
         final_zip = EXPORT_DIR / zip_name
 
-        # Create zip
-        with zipfile.ZipFile(tmp_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-            for p in items:
-                # store relative to IMAGES_DIR
-                arcname = p.relative_to(IMAGES_DIR)
-                zf.write(p, arcname)
+        # Create zip (in a worker thread so the bot stays responsive)
+        await asyncio.to_thread(_build_zip, tmp_zip, items, IMAGES_DIR)
 
         # Move to export dir
         tmp_zip.replace(final_zip)
@@ -525,27 +1127,37 @@ async def cfg_rehash(interaction: discord.Interaction):
         updated = 0
         dup_hits = 0
 
-        # We’ll use your existing helpers and set_meta(), which also maintains the hash index.
-        for p in items:
-            rec = get_meta(p)
-            if rec.get("sha256"):
-                continue  # already hashed
+        _ensure_meta_loaded()  # loaded once; the hash columns below are plain in-memory dicts
+        todo = [p for p in items if _key(p) not in _SHA256]  # skip already hashed
 
-            try:
-                raw = p.read_bytes()
-            except Exception as e:
-                print(f"cfg_rehash: failed to read {p}: {e}")
+        # Hash everything first, a bounded number of files at a time in worker threads...
+        sem = asyncio.Semaphore(os.cpu_count() or 4)
+        async def _hash(p: Path) -> Optional[str]:
+            async with sem:
+                try:
+                    return await asyncio.to_thread(_sha256_file, p)
+                except Exception as e:
+                    print(f"cfg_rehash: failed to read {p}: {e}")
+                    return None
+        shas = await asyncio.gather(*(_hash(p) for p in todo))
+
+        # ...then record the results in one pass. set_meta() also maintains the hash index;
+        # the rows are written to the DB in a single transaction afterwards.
+        hashed = []
+        for p, sha in zip(todo, shas):
+            if sha is None:
                 continue
 
-            sha = _sha256_bytes(raw)
-
             # Count if another file already registered this hash
-            db = _images_db()
-            if db.get("hashes", {}).get(sha) and db["hashes"][sha] != str(p.resolve()):
+            owner = _HASHES.get(sha)
+            if owner and owner != _key(p):
                 dup_hits += 1
 
-            set_meta(p, sha256=sha)  # stores sha and updates the hash index
+            set_meta(p, sha256=sha, persist=False)  # stores sha and updates the hash index
+            hashed.append(_key(p))
             updated += 1
+        if hashed:
+            _save_meta_rows(hashed)
 
         await interaction.followup.send(
             f"✅ Rehashed {updated} file(s). Found {dup_hits} duplicate signature(s) already present.",
@@ -563,4 +1175,7 @@ async def cfg_rehash(interaction: discord.Interaction):
 if __name__ == "__main__":
     if not TOKEN:
         raise SystemExit("Set DISCORD_TOKEN env var.")
+    # make sure buffered state hits disk on normal exit and on `systemctl stop`
+    atexit.register(_flush_all)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     bot.run(TOKEN)